@@ -0,0 +1,497 @@
+"""Офлайн бенчмарк обробки сканувань без реального обладнання.
+
+Запускає BarcodeProcessor.process_code на синтетичному потоці штрихкодів з локальними
+замінниками: відеофайл замість RTSP реєстратора (або будь-який RTSP URL), фейкова HTTP камера
+та фейковий Telegram Bot API із затримками та збоями.
+
+Приклади:
+    python benchmark.py --scans 200 --rate 5
+    python benchmark.py --source camera --camera-auth Digest --camera-latency 80 --camera-fail-rate 0.1
+    python benchmark.py --telegram-429-rate 0.2 --json result.json
+    python benchmark.py --compare baseline.json --max-regression 0.2
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BENCH_TOKEN = "123456:BENCHMARK"
+BENCH_CHAT_ID = "1000"
+BENCH_LOGIN = "admin"
+BENCH_PASSWORD = "bench"
+
+
+class FaultyHandler(BaseHTTPRequestHandler):
+    """Базовий обробник із затримкою та інжекцією збоїв (500 або обрив з'єднання)"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def inject_faults(self):
+        """True, якщо запит вже оброблено як збій"""
+        options = self.server.options
+        if options["latency"]:
+            time.sleep(options["latency"] * random.uniform(0.8, 1.2))
+        roll = random.random()
+        if roll < options["drop_rate"]:
+            self.close_connection = True
+            self.connection.close()
+            return True
+        if roll < options["drop_rate"] + options["fail_rate"]:
+            self.send_body(500, b"fault injected", "text/plain")
+            return True
+        return False
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTelegramHandler(FaultyHandler):
+    """Мінімальний Bot API: sendMessage, sendPhoto, sendMediaGroup"""
+
+    def do_POST(self):
+        self.read_body()
+        if self.inject_faults():
+            return
+        stats = self.server.stats
+        if random.random() < self.server.options["rate_limit_rate"]:
+            with self.server.lock:
+                stats["429"] += 1
+            body = json.dumps({"ok": False, "error_code": 429, "parameters": {"retry_after": 1}}).encode()
+            self.send_body(429, body, "application/json")
+            return
+        method = self.path.rsplit("/", 1)[-1]
+        with self.server.lock:
+            stats[method] = stats.get(method, 0) + 1
+        self.send_body(200, b'{"ok": true, "result": {}}', "application/json")
+
+
+class FakeCameraHandler(FaultyHandler):
+    """HTTP камера зі знімком JPEG та аутентифікацією Basic або Digest"""
+
+    def check_auth(self):
+        scheme = self.server.options["auth"]
+        header = self.headers.get("Authorization", "")
+        if scheme == "Basic":
+            import base64
+            expected = base64.b64encode(f"{BENCH_LOGIN}:{BENCH_PASSWORD}".encode()).decode()
+            if header == f"Basic {expected}":
+                return True
+            self.send_body(401, b"", "text/plain", {"WWW-Authenticate": 'Basic realm="bench"'})
+            return False
+        if scheme == "Digest":
+            if header.startswith("Digest ") and self.valid_digest(header[7:]):
+                return True
+            self.send_body(401, b"", "text/plain", {
+                "WWW-Authenticate": 'Digest realm="bench", qop="auth", nonce="%s"' % self.server.nonce})
+            return False
+        return True
+
+    def valid_digest(self, value):
+        fields = {}
+        for part in value.split(","):
+            if "=" in part:
+                key, val = part.strip().split("=", 1)
+                fields[key] = val.strip('"')
+        md5 = lambda s: hashlib.md5(s.encode()).hexdigest()
+        ha1 = md5(f"{BENCH_LOGIN}:bench:{BENCH_PASSWORD}")
+        ha2 = md5(f"GET:{fields.get('uri', '')}")
+        expected = md5(f"{ha1}:{fields.get('nonce')}:{fields.get('nc')}:{fields.get('cnonce')}:{fields.get('qop')}:{ha2}")
+        return fields.get("response") == expected
+
+    def do_GET(self):
+        if self.inject_faults():
+            return
+        if not self.check_auth():
+            return
+        self.send_body(200, self.server.jpeg, "image/jpeg")
+
+
+def start_fake_server(handler, options, **attrs):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.options = options
+    server.stats = {"429": 0}
+    server.lock = threading.Lock()
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def make_synthetic_video(path, seconds=10, fps=25, size=(1280, 720)):
+    """Відеофайл з рухомим об'єктом, що замінює потік реєстратора"""
+    import cv2
+    import numpy as np
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for i in range(seconds * fps):
+        frame = np.full((size[1], size[0], 3), 60, dtype=np.uint8)
+        x = (i * 13) % (size[0] - 200)
+        cv2.rectangle(frame, (x, 200), (x + 200, 400), (0, 180, 255), -1)
+        cv2.putText(frame, f"frame {i}", (40, 80), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+class PacedVideoCapture:
+    """Відеофайл, що читається як живий потік: кадри з частотою fps і по колу без кінця файлу"""
+
+    def __init__(self, cv2, path, *args):
+        self._cv2 = cv2
+        self._cap = cv2.VideoCapture(path, *args)
+        self._interval = 1.0 / (self._cap.get(cv2.CAP_PROP_FPS) or 25)
+        self._next = time.perf_counter()
+
+    def _wait(self):
+        delay = self._next - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        # Після паузи споживача не наздоганяємо пропущені кадри
+        self._next = max(self._next, time.perf_counter() - self._interval) + self._interval
+
+    def _rewind(self):
+        self._cap.set(self._cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def grab(self):
+        self._wait()
+        if self._cap.grab():
+            return True
+        self._rewind()
+        return self._cap.grab()
+
+    def read(self, *args):
+        self._wait()
+        ret, frame = self._cap.read(*args)
+        if not ret:
+            self._rewind()
+            ret, frame = self._cap.read(*args)
+        return ret, frame
+
+    def __getattr__(self, name):
+        return getattr(self._cap, name)
+
+
+class PacedCV2:
+    """cv2 для main: VideoCapture синтетичного файлу підміняється на PacedVideoCapture"""
+
+    def __init__(self, cv2, path):
+        self._cv2 = cv2
+        self._path = path
+
+    def VideoCapture(self, source, *args):
+        if source == self._path:
+            return PacedVideoCapture(self._cv2, source, *args)
+        return self._cv2.VideoCapture(source, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._cv2, name)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def current_rss_mb():
+    """Поточна пам'ять процесу (Linux), або None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def run_benchmark(args, workdir):
+    import main
+    import cv2
+    import numpy as np
+
+    if not args.verbose:
+        main.logging.getLogger().setLevel(main.logging.WARNING)
+
+    telegram = start_fake_server(FakeTelegramHandler, {
+        "latency": args.telegram_latency / 1000.0,
+        "fail_rate": args.telegram_fail_rate,
+        "drop_rate": args.telegram_drop_rate,
+        "rate_limit_rate": args.telegram_429_rate,
+    })
+    telegram_url = f"http://127.0.0.1:{telegram.server_address[1]}"
+    # Синхронні відправки використовують модульну адресу API
+    main.TELEGRAM_API_URL = telegram_url
+
+    config = main.create_default_config()
+    config.update({
+        "telegram_token": BENCH_TOKEN,
+        "telegram_chat_id": BENCH_CHAT_ID,
+        "telegram_api_url": telegram_url,
+        "telegram_queue": args.telegram_queue,
+        "telegram_coalesce_window": 0.2,
+        "save_folder": str(workdir / "SkanerFoto"),
+        "packers": [{"id": "001", "name": "Benchmark"}],
+        "async_pipeline": not args.sync,
+        "pipeline_queue_size": args.queue_size,
+        "pipeline_backpressure": args.backpressure,
+        "duplicate_window_seconds": 0,
+        "recorder_persistent_stream": not args.oneshot,
+        "capture_profile": args.capture_profile,
+    })
+
+    servers = [telegram]
+    if args.source == "camera":
+        jpeg = cv2.imencode(".jpg", np.full((720, 1280, 3), 90, dtype=np.uint8))[1].tobytes()
+        camera = start_fake_server(FakeCameraHandler, {
+            "latency": args.camera_latency / 1000.0,
+            "fail_rate": args.camera_fail_rate,
+            "drop_rate": args.camera_drop_rate,
+            "auth": args.camera_auth,
+        }, jpeg=jpeg, nonce=hashlib.md5(os.urandom(8)).hexdigest())
+        servers.append(camera)
+        # Відомий endpoint: запити йдуть одразу на фейкову камеру з портом
+        config.update({
+            "use_recorder": False,
+            "camera_ip": "127.0.0.1",
+            "camera_login": BENCH_LOGIN,
+            "camera_password": BENCH_PASSWORD,
+            "camera_snapshot_ip": "127.0.0.1",
+            "camera_snapshot_url": f"http://127.0.0.1:{camera.server_address[1]}/snapshot.jpg",
+            "camera_snapshot_auth": args.camera_auth if args.camera_auth != "none" else "Basic",
+        })
+    else:
+        source = args.rtsp_url
+        if not source:
+            # Без темпу файл прочитується за мить і граббер перепідключається після кінця
+            source = str(make_synthetic_video(workdir / "recorder.mp4"))
+            main.cv2 = PacedCV2(cv2, source)
+        # Шаблон, що веде на відеофайл або локальний RTSP сервер
+        templates = main.get_rtsp_templates
+        main.get_rtsp_templates = lambda: dict(templates(), benchmark={"name": "Benchmark", "main": source, "sub": source})
+        config.update({
+            "use_recorder": True,
+            "recorder_ip": "127.0.0.1",
+            "recorder_login": BENCH_LOGIN,
+            "recorder_password": BENCH_PASSWORD,
+            "recorder_rtsp_template": "benchmark",
+        })
+
+    main.config_store.save(config)
+    config = main.load_config()
+
+    delivery = None
+    if args.telegram_queue:
+        delivery = main.TelegramDeliveryService(config, workdir / main.TELEGRAM_SPOOL_FOLDER,
+                                                coalesce_window=config["telegram_coalesce_window"])
+    processor = main.BarcodeProcessor(config)
+    processor.telegram = delivery
+
+    done = {}
+    done_event = threading.Event()
+    done_lock = threading.Lock()
+
+    def on_processed(item):
+        if not item.get("code"):
+            return
+        with done_lock:
+            done[item["code"]] = (time.time(), item["scan_time"], item["status"])
+            if len(done) >= args.scans:
+                done_event.set()
+
+    pipeline = None
+    if not args.sync:
+        pipeline = main.ScanPipeline(processor, status_callback=on_processed,
+                                     queue_size=args.queue_size, policy=args.backpressure)
+        processor.pipeline = pipeline
+
+    main.start_config_grabbers(config)
+    processor.process_code("001")
+    if args.warmup:
+        time.sleep(args.warmup)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_start = current_rss_mb()
+    rng = random.Random(args.seed)
+    codes = [f"48{rng.randrange(10 ** 10):010d}{i % 10}" for i in range(args.scans)]
+    interval = 1.0 / args.rate if args.rate > 0 else 0
+    submit_latencies = []
+    started = time.time()
+    cpu_started = time.process_time()
+
+    for i, code in enumerate(codes):
+        if interval:
+            # Рівномірний потік сканувань із заданою частотою
+            delay = started + i * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        before = time.perf_counter()
+        result = processor.process_code(code)
+        submit_latencies.append(time.perf_counter() - before)
+        if args.sync:
+            on_processed({"code": code, "scan_time": time.time() - submit_latencies[-1],
+                          "status": "done" if result and result.startswith("Оброблено") else "failed"})
+        elif result and not result.startswith("Прийнято"):
+            # Відхилене конвеєром сканування не чекаємо
+            on_processed({"code": code, "scan_time": time.time(), "status": "rejected"})
+
+    done_event.wait(args.timeout)
+    finished = time.time()
+    cpu_used = time.process_time() - cpu_started
+    telegram_drain = None
+    if delivery:
+        drain_started = time.time()
+        while delivery.pending() and time.time() - drain_started < args.timeout:
+            time.sleep(0.05)
+        telegram_drain = time.time() - drain_started
+
+    peak_traced = None
+    if args.tracemalloc:
+        peak_traced = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    rss_end = current_rss_mb()
+
+    if pipeline:
+        pipeline.stop()
+    if delivery:
+        delivery.stop()
+    main.stop_rtsp_grabbers()
+    main.close_all_journals()
+    for server in servers:
+        server.shutdown()
+
+    latencies = [t_done - t_scan for t_done, t_scan, status in done.values() if status == "done"]
+    statuses = {}
+    for _, _, status in done.values():
+        statuses[status] = statuses.get(status, 0) + 1
+    timings, counters, _ = main.metrics.snapshot()
+
+    return {
+        "scans": args.scans,
+        "completed": len(done),
+        "statuses": statuses,
+        "duration_s": round(finished - started, 3),
+        "scans_per_sec": round(len(latencies) / (finished - started), 2) if finished > started else 0,
+        "latency_ms": {name: round(percentile(latencies, q) * 1000, 1)
+                       for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))},
+        "submit_ms_p95": round(percentile(submit_latencies, 0.95) * 1000, 2),
+        # Процесорний час усіх потоків відносно тривалості (100 - одне ядро)
+        "cpu_percent": round(100 * cpu_used / (finished - started), 1) if finished > started else 0,
+        "telegram_drain_s": round(telegram_drain, 2) if telegram_drain is not None else None,
+        "telegram_server": dict(telegram.stats),
+        "rss_mb": {"start": rss_start and round(rss_start, 1), "end": rss_end and round(rss_end, 1)},
+        "tracemalloc_peak_mb": peak_traced and round(peak_traced, 1),
+        "stages_ms_p95": {
+            f"{row['name']}{dict(row['labels']) or ''}": round(row["quantiles"][0.95] * 1000, 1)
+            for row in timings
+        },
+    }
+
+
+def print_report(result):
+    print(f"Сканувань: {result['scans']}, завершено: {result['completed']} {result['statuses']}")
+    print(f"Тривалість: {result['duration_s']} с, пропускна здатність: {result['scans_per_sec']} скан/с")
+    latency = result["latency_ms"]
+    print(f"Затримка сканування, мс: p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    print(f"Прийом сканування (process_code) p95: {result['submit_ms_p95']} мс")
+    print(f"Процесор: {result['cpu_percent']}% одного ядра")
+    if result["telegram_drain_s"] is not None:
+        print(f"Черга Telegram спорожніла за {result['telegram_drain_s']} с")
+    print(f"Запити до фейкового Telegram: {result['telegram_server']}")
+    print(f"Пам'ять RSS, МБ: {result['rss_mb']}, пік tracemalloc: {result['tracemalloc_peak_mb']}")
+    print("Етапи (p95, мс):")
+    for name, value in sorted(result["stages_ms_p95"].items()):
+        print(f"  {name}: {value}")
+
+
+def compare(result, baseline, max_regression):
+    """Список регресій відносно базового результату"""
+    regressions = []
+    for key in ("p50", "p95", "p99"):
+        old, new = baseline["latency_ms"][key], result["latency_ms"][key]
+        if old and new > old * (1 + max_regression):
+            regressions.append(f"затримка {key}: {old} → {new} мс")
+    old, new = baseline["scans_per_sec"], result["scans_per_sec"]
+    if old and new < old * (1 - max_regression):
+        regressions.append(f"пропускна здатність: {old} → {new} скан/с")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарк обробки сканувань")
+    parser.add_argument("--scans", type=int, default=100, help="кількість сканувань")
+    parser.add_argument("--rate", type=float, default=0, help="сканувань за секунду (0 - максимально швидко)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--source", choices=("recorder", "camera"), default="recorder")
+    parser.add_argument("--rtsp-url", help="RTSP URL локального сервера замість синтетичного відеофайлу")
+    parser.add_argument("--oneshot", action="store_true", help="нове RTSP підключення на кожне сканування")
+    parser.add_argument("--capture-profile", choices=("quality", "low_cost"), default="quality")
+    parser.add_argument("--sync", action="store_true", help="синхронна обробка без конвеєра")
+    parser.add_argument("--queue-size", type=int, default=20)
+    parser.add_argument("--backpressure", default="block", choices=("block", "drop_oldest", "reject"))
+    parser.add_argument("--telegram-queue", action="store_true", help="доставка через фонову чергу на диску")
+    parser.add_argument("--telegram-latency", type=float, default=50, help="мс")
+    parser.add_argument("--telegram-fail-rate", type=float, default=0)
+    parser.add_argument("--telegram-drop-rate", type=float, default=0)
+    parser.add_argument("--telegram-429-rate", type=float, default=0)
+    parser.add_argument("--camera-latency", type=float, default=30, help="мс")
+    parser.add_argument("--camera-fail-rate", type=float, default=0)
+    parser.add_argument("--camera-drop-rate", type=float, default=0)
+    parser.add_argument("--camera-auth", choices=("Basic", "Digest", "none"), default="Digest")
+    parser.add_argument("--warmup", type=float, default=1.0, help="секунд на відкриття потоків перед стартом")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--tracemalloc", action="store_true", help="пік виділеної Python пам'яті (повільніше)")
+    parser.add_argument("--json", help="зберегти результат у JSON")
+    parser.add_argument("--compare", help="базовий JSON результат для перевірки регресій")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="допустиме погіршення (частка)")
+    parser.add_argument("--verbose", action="store_true", help="журнал програми в консоль")
+    args = parser.parse_args()
+
+    # Шляхи користувача - відносно поточної папки, до переходу в робочу
+    args.json = args.json and os.path.abspath(args.json)
+    args.compare = args.compare and os.path.abspath(args.compare)
+    # Програма пише config.json, app.log та фото відносно робочої папки - ізолюємо їх
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    workdir = Path(tempfile.mkdtemp(prefix="scanf-bench-"))
+    os.chdir(workdir)
+    print(f"Робоча папка: {workdir}")
+
+    result = run_benchmark(args, workdir)
+    print_report(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.max_regression)
+        if regressions:
+            print("❌ Регресії продуктивності:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("✅ Без регресій відносно базового результату")
+
+
+if __name__ == "__main__":
+    main_cli()